@@ -3,6 +3,7 @@
 import sys
 import json
 import atexit
+import signal
 import argparse
 
 __version__ = (0, 5, 2)
@@ -50,6 +51,10 @@ def cleanup():
 
 atexit.register(cleanup)
 
+def start_profiling(signum, frame):
+    for server in servers:
+        if server: server.profiler.arm()
+
 def main():
 
     parser = argparse.ArgumentParser(prog=APP_NAME,
@@ -61,6 +66,9 @@ def main():
             help="The JSON formatted server configuration file.")
     args = parser.parse_args()
 
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, start_profiling)
+
     try:
         config = DEFAULT_CONFIG
         if args.config:
@@ -70,6 +78,10 @@ def main():
             conf.update(config)
             servers.append(TCPServer(conf))
 
+        # executors refuse new work once the main thread has finished
+        for server in servers:
+            server.thread.join()
+
     except (KeyboardInterrupt, SystemExit, Exception) as e:
         print(e, file=sys.stderr)
 
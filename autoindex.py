@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import html
+import posixpath
+import threading
+from time import perf_counter
+from datetime import datetime
+from collections import OrderedDict
+from urllib.parse import quote, unquote, urlparse, parse_qs
+
+from util import *
+
+FORMATS = ["text/html", "application/json"]
+
+class Listing:
+    """The entries of one directory as of `mtime`, with the pages rendered from them so far."""
+
+    __slots__ = ("mtime", "entries", "pages")
+    def __init__(self, mtime, entries):
+        self.mtime = mtime
+        self.entries = entries
+        self.pages = {}
+
+class DirectoryIndex:
+    """Renders listings of directories without an index file, for one location.
+
+    Listings are paginated and offered as HTML or JSON depending on the Accept
+    header. The entries of each directory, and every page rendered from them,
+    are kept in memory until the directory's modification time changes, so
+    browsing a large directory only lists it once.
+    """
+
+    def __init__(self, config):
+        self.page_size = config.get("autoindex_page_size", 1000)
+        self.max_listings = config.get("autoindex_cache_size", 256)
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+
+    def _scan(self, path):
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                    st = entry.stat()
+                except OSError:
+                    # broken symlinks and the like can't be served anyway
+                    continue
+                entries.append((entry.name, is_dir, 0 if is_dir else st.st_size, int(st.st_mtime)))
+
+        entries.sort(key=lambda e: (not e[1], e[0]))
+        return entries
+
+    def listing(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is not None and listing.mtime == mtime:
+                self.listings.move_to_end(path)
+                return listing
+
+        listing = Listing(mtime, self._scan(path))
+        with self.lock:
+            self.listings[path] = listing
+            self.listings.move_to_end(path)
+            while len(self.listings) > self.max_listings:
+                self.listings.popitem(last=False)
+
+        return listing
+
+    def _render_json(self, url, entries, page, pages, total):
+        return json.dumps({
+            "path": url,
+            "page": page,
+            "pages": pages,
+            "total": total,
+            "entries": [{
+                "name": name,
+                "type": "directory" if is_dir else "file",
+                "size": size,
+                "modified": mtime
+            } for name, is_dir, size, mtime in entries]
+        }).encode("utf-8")
+
+    def _render_html(self, url, entries, page, pages, total):
+        title = html.escape("Index of " + url)
+        rows = []
+        if url != "/":
+            rows.append('<tr><td><a href="../">../</a></td><td></td><td></td></tr>')
+        for name, is_dir, size, mtime in entries:
+            name += "/" if is_dir else ""
+            rows.append('<tr><td><a href="{}">{}</a></td><td>{}</td><td>{}</td></tr>'.format(
+                quote(name), html.escape(name), htmltime(datetime.utcfromtimestamp(mtime)),
+                "-" if is_dir else size))
+
+        links = []
+        if page > 1:
+            links.append('<a href="?page={}">Previous</a>'.format(page - 1))
+        if page < pages:
+            links.append('<a href="?page={}">Next</a>'.format(page + 1))
+
+        return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{0}</title></head>\n"
+                "<body><h1>{0}</h1>\n<table>\n<tr><th>Name</th><th>Last modified</th><th>Size</th></tr>\n"
+                "{1}\n</table>\n<p>{2} entries, page {3} of {4} {5}</p></body></html>\n").format(
+                    title, "\n".join(rows), total, page, pages, " ".join(links)).encode("utf-8")
+
+    def render(self, listing, url, fmt, page):
+        # every URL reaching this directory shares the pages, since `url` is canonical
+        key = (fmt, page)
+        body = listing.pages.get(key)
+        if body is None:
+            total = len(listing.entries)
+            pages = max(1, -(-total // self.page_size))
+            if page > pages:
+                raise HTTPError(codes.NOT_FOUND)
+
+            entries = listing.entries[(page - 1) * self.page_size:page * self.page_size]
+            render = self._render_json if fmt == "application/json" else self._render_html
+            body = listing.pages[key] = render(url, entries, page, pages, total)
+
+        return body
+
+    def __call__(self, req, res, path):
+        fmt = req.accept_formats.negotiate(FORMATS)
+        if fmt is None:
+            raise HTTPError(codes.NOT_ACCEPTABLE)
+
+        try:
+            page = int(parse_qs(req.query or "").get("page", ["1"])[0])
+        except ValueError:
+            raise HTTPError(codes.BAD_REQUEST, "Invalid page\r\n")
+        if page < 1:
+            raise HTTPError(codes.BAD_REQUEST, "Invalid page\r\n")
+
+        t = perf_counter()
+        try:
+            listing = self.listing(path)
+        except PermissionError:
+            raise HTTPError(codes.FORBIDDEN)
+        finally:
+            req.timer.add("fs", perf_counter() - t)
+
+        modtime = datetime.utcfromtimestamp(listing.mtime // 1000000000)
+        res.set("Vary", "Accept")
+        res.set("Last-Modified", htmltime(modtime))
+        if req.get("If-Modified-Since"):
+            try:
+                if fromhtmltime(req.get("If-Modified-Since")) >= modtime:
+                    raise HTTPError(codes.NOT_MODIFIED)
+            except ValueError:
+                pass
+
+        url = "/" + posixpath.normpath(unquote(urlparse(req.fullpath).path)).lstrip("/")
+        body = self.render(listing, url if url == "/" else url + "/", fmt, page)
+        res.set("Content-Type", "{}; charset=utf-8".format(fmt))
+        if req.method == "HEAD":
+            res.set("Content-Length", len(body))
+            res.send()
+        else:
+            res.send(body)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import pickle
+import hashlib
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+from util import *
+
+CACHEABLE_CODES = (200, 203, 204, 300, 301, 404, 410)
+# how many resources are remembered as not cacheable, so their requests skip coalescing
+UNCACHEABLE_MEMORY = 1024
+# directives which let a response to a request with Authorization be shared (RFC 9111, 3.5)
+SHARED_DIRECTIVES = ("public", "s-maxage", "must-revalidate")
+UNSTORED_HEADERS = ("Connection", "Keep-Alive", "Transfer-Encoding", "Content-Length", "Date", "Server", "Age")
+
+def parse_cache_control(value):
+    directives = {}
+    for d in COMMA_RE.split(value or ""):
+        if not d: continue
+        key, _, arg = d.partition("=")
+        directives[key.strip().lower()] = arg.strip('"')
+
+    return directives
+
+def dechunk(data):
+    body = b''
+    while data:
+        size, _, data = data.partition(b"\r\n")
+        size = int(size.split(b";")[0], 16)
+        if size == 0: break
+        body += data[:size]
+        data = data[size + 2:]
+
+    return body
+
+class CacheEntry:
+
+    __slots__ = ("status", "headers", "body", "vary", "shared", "stored", "expires", "size")
+    def __init__(self, status, headers, body, vary, lifetime, shared=False):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.vary = vary
+        self.shared = shared
+        self.stored = time.time()
+        self.expires = self.stored + lifetime
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+    def fresh(self):
+        return time.time() < self.expires
+
+class _Recorder:
+    """Stands in for a response's socket, keeping a copy of the body as it is sent.
+
+    Once the headers are out, `storable` decides whether the response could
+    be cached at all. When it can't, or the body outgrows `limit`, recording
+    stops and `abandon` is called.
+    """
+
+    __slots__ = ("conn", "res", "body", "limit", "overflow", "started", "storable", "abandon")
+    def __init__(self, conn, res, limit, storable, abandon):
+        self.conn = conn
+        self.res = res
+        self.body = []
+        self.limit = limit
+        self.overflow = False
+        self.started = False
+        self.storable = storable
+        self.abandon = abandon
+
+    def _give_up(self):
+        self.overflow = True
+        self.body = []
+        self.abandon()
+
+    def _admit(self, size):
+        if self.overflow or not self.res.headers_sent:
+            return False
+
+        if not self.started:
+            self.started = True
+            if not self.storable():
+                self._give_up()
+                return False
+
+        self.limit -= size
+        if self.limit < 0:
+            self._give_up()
+            return False
+        return True
+
+    def sendall(self, data):
+        record = self._admit(len(data))
+        self.conn.sendall(data)
+        if record:
+            self.body.append(bytes(data))
+
+    def sendfile(self, fp, offset=0, count=None):
+        if count is None and not self.overflow:
+            self._give_up()
+        if not self._admit(count):
+            return self.conn.sendfile(fp, offset, count)
+
+        fp.seek(offset)
+        data = fp.read(count)
+        self.conn.sendall(data)
+        self.body.append(data)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class ResponseCache:
+    """An in-memory LRU cache of complete responses, shared by the locations of a server.
+
+    Entries are bounded by total size in bytes. When `cache_dir` is configured,
+    entries evicted from memory move to disk until that tier is also full.
+    Concurrent misses for the same resource wait for the first one to fill
+    the cache instead of all running the handler.
+    """
+
+    def __init__(self, config):
+        self.max_size = config.get("cache_size", 64 * 1024 * 1024)
+        self.max_entry = config.get("cache_max_entry", 1024 * 1024)
+        self.directory = config.get("cache_dir")
+        self.max_disk_size = config.get("cache_disk_size", 1024 * 1024 * 1024)
+        self.wait_timeout = config.get("cache_wait_timeout", 10)
+
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()
+        self.size = 0
+        self.disk_size = 0
+        self.vary = {}
+        self.filling = {}
+        self.uncacheable = OrderedDict()
+        self.hooks = []
+        self.stats = dict.fromkeys(("hits", "misses", "stores", "evictions", "coalesced"), 0)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _event(self, name, key):
+        self.stats[name] += 1
+        for hook in self.hooks:
+            hook(name, key)
+
+    def _primary_key(self, req):
+        return (req.host, req.port, req.fullpath)
+
+    def _vary_value(self, req, name):
+        if name == "accept-encoding":
+            value = req.get("Accept-Encoding")
+            if value is None:
+                # told apart from any header, since send_file only compresses for HTTP/1.1 then
+                return None if req.version >= "1.1" else False
+
+            # any coding may have been chosen, so the variant is the set of acceptable ones
+            try:
+                codings = (HTTPNegotiation.parse_value(f) for f in COMMA_RE.split(value) if f)
+                return ",".join(sorted({c.strip().lower() for c, q in codings if q > 0}))
+            except ValueError:
+                return value
+
+        return req.get(name, "")
+
+    def _key(self, req, primary, names):
+        return primary, tuple(self._vary_value(req, name) for name in names)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+
+    def lookup(self, req, primary):
+        with self.lock:
+            names = self.vary.get(primary, [()])[0]
+            key = self._key(req, primary, names)
+
+            entry = self.memory.get(key)
+            if entry is None and key in self.disk:
+                entry = self._load(key)
+            elif entry is not None:
+                self.memory.move_to_end(key)
+
+            if entry is not None and not entry.fresh():
+                self._drop(key)
+                entry = None
+
+            self._event("hits" if entry else "misses", key)
+            return entry
+
+    def store(self, req, primary, entry):
+        if entry.size > self.max_entry:
+            return
+
+        with self.lock:
+            key = self._key(req, primary, entry.vary)
+            if key in self.memory or key in self.disk:
+                self._drop(key)
+
+            names, count = self.vary.get(primary, (entry.vary, 0))
+            if names != entry.vary:
+                # the resource changed what it varies on, older variants are unreachable
+                for other in [k for k in list(self.memory) + list(self.disk) if k[0] == primary]:
+                    self._drop(other)
+                count = 0
+            self.vary[primary] = (entry.vary, count + 1)
+
+            self.uncacheable.pop(primary, None)
+            self.memory[key] = entry
+            self.size += entry.size
+            self._event("stores", key)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size and self.memory:
+            key, entry = self.memory.popitem(last=False)
+            self.size -= entry.size
+            self._event("evictions", key)
+            if self.directory and entry.fresh():
+                self._spill(key, entry)
+            else:
+                self._forget(key)
+
+        while self.disk_size > self.max_disk_size and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            self._unlink(key)
+            self._forget(key)
+
+    def _spill(self, key, entry):
+        try:
+            with open(self._disk_path(key), "wb") as fp:
+                pickle.dump(entry, fp)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return self._forget(key)
+
+        self.disk[key] = entry.size
+        self.disk_size += entry.size
+
+    def _load(self, key):
+        size = self.disk.pop(key)
+        self.disk_size -= size
+        try:
+            with open(self._disk_path(key), "rb") as fp:
+                entry = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(e, file=sys.stderr)
+            self._forget(key)
+            return None
+        finally:
+            self._unlink(key)
+
+        self.memory[key] = entry
+        self.size += entry.size
+        self._evict()
+        return entry
+
+    def _unlink(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _drop(self, key):
+        if key in self.memory:
+            self.size -= self.memory.pop(key).size
+        elif key in self.disk:
+            self.disk_size -= self.disk.pop(key)
+            self._unlink(key)
+        else:
+            return
+
+        self._forget(key)
+
+    def _forget(self, key):
+        names, count = self.vary.get(key[0], ((), 1))
+        if count <= 1:
+            self.vary.pop(key[0], None)
+        else:
+            self.vary[key[0]] = (names, count - 1)
+
+    def _claim(self, primary):
+        with self.lock:
+            if primary in self.uncacheable:
+                return None, False
+
+            event = self.filling.get(primary)
+            if event is None:
+                event = self.filling[primary] = threading.Event()
+                return event, True
+
+            self._event("coalesced", primary)
+            return event, False
+
+    def _give_up(self, primary, event):
+        with self.lock:
+            self.uncacheable[primary] = True
+            self.uncacheable.move_to_end(primary)
+            while len(self.uncacheable) > UNCACHEABLE_MEMORY:
+                self.uncacheable.popitem(last=False)
+
+        self._release(primary, event)
+
+    def _release(self, primary, event):
+        with self.lock:
+            if self.filling.get(primary) is event:
+                del self.filling[primary]
+        event.set()
+
+    def _freshness(self, res, ttl):
+        """Returns what a response varies on and how long it stays fresh, or None if it can't be stored."""
+        if res.status_code not in CACHEABLE_CODES or "Set-Cookie" in res.headers:
+            return None
+        try:
+            if int(res.headers.get("Content-Length", 0)) > self.max_entry:
+                return None
+        except ValueError:
+            return None
+
+        control = parse_cache_control(res.headers.get("Cache-Control"))
+        if "no-store" in control or "private" in control or "no-cache" in control:
+            return None
+        if "Authorization" in res.request.headers and not any(d in control for d in SHARED_DIRECTIVES):
+            return None
+
+        vary = tuple(sorted(n.lower() for n in COMMA_RE.split(res.headers.get("Vary", "")) if n))
+        if "*" in vary:
+            return None
+
+        lifetime = ttl
+        try:
+            if "s-maxage" in control:
+                lifetime = int(control["s-maxage"])
+            elif "max-age" in control:
+                lifetime = int(control["max-age"])
+            elif "Expires" in res.headers:
+                lifetime = (fromhtmltime(res.headers["Expires"]) - datetime.utcnow()).total_seconds()
+        except ValueError:
+            return None
+
+        if lifetime <= 0:
+            return None
+        return vary, lifetime
+
+    def _entry_from(self, req, res, recorder, ttl):
+        freshness = None if recorder.overflow else self._freshness(res, ttl)
+        if freshness is None:
+            return None
+
+        vary, lifetime = freshness
+        body = b''.join(recorder.body)
+        if res.headers.get("Transfer-Encoding") == "chunked" and req.version < "2":
+            body = dechunk(body)
+
+        headers = [(k, str(v)) for k, v in res.headers.items() if k not in UNSTORED_HEADERS]
+        control = parse_cache_control(res.headers.get("Cache-Control"))
+        shared = any(d in control for d in SHARED_DIRECTIVES)
+        return CacheEntry(res.status_code, headers, body, vary, lifetime, shared)
+
+    def _replay(self, entry, req, res):
+        modified = dict(entry.headers).get("Last-Modified")
+        if modified and req.get("If-Modified-Since"):
+            try:
+                if fromhtmltime(req.get("If-Modified-Since")) >= fromhtmltime(modified):
+                    raise HTTPError(codes.NOT_MODIFIED)
+            except ValueError:
+                pass
+
+        res.set(dict(entry.headers))
+        res.set("Age", str(int(time.time() - entry.stored)))
+        res.status(entry.status)
+        if req.method == "HEAD":
+            res.set("Content-Length", len(entry.body))
+            res.send()
+        else:
+            res.send(entry.body)
+
+    def wrap(self, f, ttl=0):
+        def handle(req, res):
+            control = parse_cache_control(req.get("Cache-Control"))
+            if req.method not in ("GET", "HEAD") or "no-store" in control or "no-cache" in control:
+                return f(req, res)
+
+            # a response to someone else can only be reused with credentials if it says so
+            authorized = "Authorization" in req.headers
+            primary = self._primary_key(req)
+            entry = self.lookup(req, primary)
+            if entry and (entry.shared or not authorized):
+                return self._replay(entry, req, res)
+
+            if req.method == "HEAD":
+                return f(req, res)
+
+            event, filler = (None, False) if authorized else self._claim(primary)
+            if event is not None and not filler:
+                event.wait(self.wait_timeout)
+                entry = self.lookup(req, primary)
+                if entry:
+                    return self._replay(entry, req, res)
+
+            # requests waiting on this one are let go as soon as it can't be cached
+            recorder = _Recorder(res.conn, res, self.max_entry,
+                                 lambda: self._freshness(res, ttl) is not None,
+                                 lambda: filler and self._give_up(primary, event))
+            res.conn = recorder
+            try:
+                result = f(req, res)
+                if not result and res.body_sent:
+                    entry = self._entry_from(req, res, recorder, ttl)
+                    if entry:
+                        self.store(req, primary, entry)
+                return result
+
+            finally:
+                res.conn = recorder.conn
+                if filler:
+                    self._release(primary, event)
+
+        return handle
+
+    def close(self):
+        with self.lock:
+            for key in list(self.disk):
+                self._unlink(key)
+            self.disk.clear()
@@ -5,6 +5,8 @@ import threading
 from util import *
 from request import Request
 from router import Router, static, not_found
+from shaping import TokenBucket
+from http2 import HTTP2Connection, is_h2c_upgrade
 
 class HTTPConnection:
     """A class that handles a single HTTP conversation to a TCP client.
@@ -16,18 +18,32 @@ class HTTPConnection:
     def __init__(self, server, conn_info):
         self.server = server
         self.config = server.config
+        self.profiler = server.profiler
+        rate = self.config.get("connection_rate_limit")
+        self.rate_limit = TokenBucket(rate) if rate else None
         self.conn, self.addr = conn_info
         self.conn.settimeout(self.config.get("timeout") or 15)
 
         self.thread = threading.Thread(target=self._worker, daemon=True)
         self.thread.start()
 
-    def _worker(self):
+    def _build_router(self):
         router = Router()
 
+        if self.config.get("profile_route"):
+            router.get(self.config.get("profile_route"), self.profiler.route)
+
         for mountpoint, conf in self.config.get("locations", {}).items():
             conf.update(self.config)
-            router.use(mountpoint, static(conf.get("root")))
+            if mountpoint in self.server.wsgi_apps:
+                handler = self.server.wsgi_apps[mountpoint]
+            else:
+                handler = static(conf.get("root"), self.server.rate_limits.get(mountpoint),
+                                 self.server.autoindexes.get(mountpoint))
+
+            if conf.get("cache"):
+                handler = self.server.cache.wrap(handler, conf.get("cache_ttl", 0))
+            router.use(mountpoint, handler)
 
         for code, page in self.config.get("error_pages", {}).items():
             def handler(err, req, res):
@@ -37,15 +53,39 @@ class HTTPConnection:
             router.handler(handler)
 
         router.use(not_found)
+        return router
 
+    def _worker(self):
+        try:
+            self._serve()
+        finally:
+            self.close()
+
+    def _serve(self):
+        self.router = self._build_router()
+        http2 = self.config.get("http2", True)
+
+        req = Request(self)
         while True:
-            req = Request(self)
-            if not req or self.closed: break
+            req.receive()
+            if http2 and req.method == "PRI":
+                self.profiler.discard(req)
+                HTTP2Connection(self, HTTP2_PREFACE_LINE + b"\r\n\r\n" + req.payload).run()
+                break
+
+            if not req or self.closed:
+                self.profiler.discard(req)
+                break
 
-            err = router(req, req.response)
-            if err: break
+            if http2 and is_h2c_upgrade(req):
+                self.profiler.discard(req)
+                HTTP2Connection(self).run(upgrade=req)
+                break
 
-        return self.close()
+            err = self.router(req, req.response)
+            req.timer.mark("handle")
+            self.profiler.finish(req)
+            if err or self.closed: break
 
     def close(self):
         if not self.closed:
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# HPACK header compression for HTTP/2 (RFC 7541)
+
+class HPACKError(Exception):
+    pass
+
+class HeaderListTooLarge(HPACKError):
+    pass
+
+STATIC_TABLE = [
+    (b":authority", b""),
+    (b":method", b"GET"),
+    (b":method", b"POST"),
+    (b":path", b"/"),
+    (b":path", b"/index.html"),
+    (b":scheme", b"http"),
+    (b":scheme", b"https"),
+    (b":status", b"200"),
+    (b":status", b"204"),
+    (b":status", b"206"),
+    (b":status", b"304"),
+    (b":status", b"400"),
+    (b":status", b"404"),
+    (b":status", b"500"),
+    (b"accept-charset", b""),
+    (b"accept-encoding", b"gzip, deflate"),
+    (b"accept-language", b""),
+    (b"accept-ranges", b""),
+    (b"accept", b""),
+    (b"access-control-allow-origin", b""),
+    (b"age", b""),
+    (b"allow", b""),
+    (b"authorization", b""),
+    (b"cache-control", b""),
+    (b"content-disposition", b""),
+    (b"content-encoding", b""),
+    (b"content-language", b""),
+    (b"content-length", b""),
+    (b"content-location", b""),
+    (b"content-range", b""),
+    (b"content-type", b""),
+    (b"cookie", b""),
+    (b"date", b""),
+    (b"etag", b""),
+    (b"expect", b""),
+    (b"expires", b""),
+    (b"from", b""),
+    (b"host", b""),
+    (b"if-match", b""),
+    (b"if-modified-since", b""),
+    (b"if-none-match", b""),
+    (b"if-range", b""),
+    (b"if-unmodified-since", b""),
+    (b"last-modified", b""),
+    (b"link", b""),
+    (b"location", b""),
+    (b"max-forwards", b""),
+    (b"proxy-authenticate", b""),
+    (b"proxy-authorization", b""),
+    (b"range", b""),
+    (b"referer", b""),
+    (b"refresh", b""),
+    (b"retry-after", b""),
+    (b"server", b""),
+    (b"set-cookie", b""),
+    (b"strict-transport-security", b""),
+    (b"transfer-encoding", b""),
+    (b"user-agent", b""),
+    (b"vary", b""),
+    (b"via", b""),
+    (b"www-authenticate", b"")
+]
+
+STATIC_FIELDS = {field: i + 1 for i, field in reversed(list(enumerate(STATIC_TABLE)))}
+STATIC_NAMES = {name: i + 1 for i, (name, _) in reversed(list(enumerate(STATIC_TABLE)))}
+
+# The HPACK Huffman code is canonical, so it is fully described by the
+# symbols having each code length (RFC 7541, Appendix B).
+HUFFMAN_LENGTHS = {
+    5: b"012aceiost",
+    6: b" %-./3456789=A_bdfghlmnpru",
+    7: b":BCDEFGHIJKLMNOPQRSTUVWYjkqvwxyz",
+    8: b"&*,;XZ",
+    10: b"!\"()?",
+    11: b"'+|",
+    12: b"#>",
+    13: b"\x00$@[]~",
+    14: b"^}",
+    15: b"<`{",
+    19: bytes([92, 195, 208]),
+    20: bytes([128, 130, 131, 162, 184, 194, 224, 226]),
+    21: bytes([153, 161, 167, 172, 176, 177, 179, 209, 216, 217, 227, 229, 230]),
+    22: bytes([129, 132, 133, 134, 136, 146, 154, 156, 160, 163, 164, 169, 170, 173, 178,
+               181, 185, 186, 187, 189, 190, 196, 198, 228, 232, 233]),
+    23: bytes([1, 135, 137, 138, 139, 140, 141, 143, 147, 149, 150, 151, 152, 155, 157,
+               158, 165, 166, 168, 174, 175, 180, 182, 183, 188, 191, 197, 231, 239]),
+    24: bytes([9, 142, 144, 145, 148, 159, 171, 206, 215, 225, 236, 237]),
+    25: bytes([199, 207, 234, 235]),
+    26: bytes([192, 193, 200, 201, 202, 205, 210, 213, 218, 219, 238, 240, 242, 243, 255]),
+    27: bytes([203, 204, 211, 212, 214, 221, 222, 223, 241, 244, 245, 246, 247, 248, 250,
+               251, 252, 253, 254]),
+    28: bytes([2, 3, 4, 5, 6, 7, 8, 11, 12, 14, 15, 16, 17, 18, 19, 20, 21, 23, 24, 25, 26,
+               27, 28, 29, 30, 31, 127, 220, 249]),
+    30: bytes([10, 13, 22])
+}
+EOS = 256
+
+def _build_huffman():
+    codes = {}
+    code = 0
+    last = 0
+    for length in sorted(HUFFMAN_LENGTHS):
+        code <<= length - last
+        last = length
+        symbols = list(HUFFMAN_LENGTHS[length]) + ([EOS] if length == 30 else [])
+        for sym in symbols:
+            codes[(length, code)] = sym
+            code += 1
+
+    return codes
+
+HUFFMAN_DECODE = _build_huffman()
+HUFFMAN_MIN_LENGTH = min(HUFFMAN_LENGTHS)
+
+def huffman_decode(data):
+    out = bytearray()
+    code = 0
+    length = 0
+    for byte in data:
+        for shift in range(7, -1, -1):
+            code = (code << 1) | ((byte >> shift) & 1)
+            length += 1
+            if length < HUFFMAN_MIN_LENGTH:
+                continue
+
+            sym = HUFFMAN_DECODE.get((length, code))
+            if sym is None:
+                if length >= 30:
+                    raise HPACKError("Invalid Huffman code")
+                continue
+
+            if sym == EOS:
+                raise HPACKError("EOS in Huffman string")
+            out.append(sym)
+            code = 0
+            length = 0
+
+    # the remainder must be padding: fewer than 8 bits, all ones
+    if length > 7 or code != (1 << length) - 1:
+        raise HPACKError("Invalid Huffman padding")
+
+    return bytes(out)
+
+def encode_integer(value, prefix, flags=0):
+    limit = (1 << prefix) - 1
+    if value < limit:
+        return bytes([flags | value])
+
+    out = bytearray([flags | limit])
+    value -= limit
+    while value >= 128:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def decode_integer(data, pos, prefix):
+    if pos >= len(data):
+        raise HPACKError("Truncated integer")
+
+    limit = (1 << prefix) - 1
+    value = data[pos] & limit
+    pos += 1
+    if value < limit:
+        return value, pos
+
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 28:
+            raise HPACKError("Invalid integer")
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+def encode_string(value):
+    return encode_integer(len(value), 7) + value
+
+def decode_string(data, pos):
+    huffman = pos < len(data) and data[pos] & 0x80
+    length, pos = decode_integer(data, pos, 7)
+    if pos + length > len(data):
+        raise HPACKError("Truncated string")
+
+    value = bytes(data[pos:pos + length])
+    if huffman:
+        value = huffman_decode(value)
+    return value, pos + length
+
+class Decoder:
+    """Decodes header blocks, keeping the dynamic table shared by a connection's blocks."""
+
+    def __init__(self, max_table_size=4096):
+        self.max_table_size = max_table_size
+        self.table_size = max_table_size
+        self.dynamic = []
+        self.size = 0
+
+    def _add(self, name, value):
+        self.dynamic.insert(0, (name, value))
+        self.size += 32 + len(name) + len(value)
+        self._shrink()
+
+    def _shrink(self):
+        while self.size > self.table_size and self.dynamic:
+            name, value = self.dynamic.pop()
+            self.size -= 32 + len(name) + len(value)
+
+    def _lookup(self, index):
+        if 0 < index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+
+        index -= len(STATIC_TABLE) + 1
+        if 0 <= index < len(self.dynamic):
+            return self.dynamic[index]
+
+        raise HPACKError("Invalid table index")
+
+    def decode(self, data, max_list_size=None):
+        """Decodes a header block into a list of (name, value) pairs.
+
+        Past `max_list_size` (counted as in SETTINGS_MAX_HEADER_LIST_SIZE) the
+        rest of the block is still decoded, to keep the dynamic table in step
+        with the encoder's, but HeaderListTooLarge is raised at the end.
+        """
+        headers = []
+        size = 0
+        pos = 0
+        while pos < len(data):
+            byte = data[pos]
+            if byte & 0x80:
+                index, pos = decode_integer(data, pos, 7)
+                field = self._lookup(index)
+            else:
+                field, pos = self._literal(data, pos)
+                if field is None:
+                    continue
+
+            size += 32 + len(field[0]) + len(field[1])
+            if max_list_size is None or size <= max_list_size:
+                headers.append(field)
+
+        if max_list_size is not None and size > max_list_size:
+            raise HeaderListTooLarge("Header list too large")
+        return headers
+
+    def _literal(self, data, pos):
+        # a dynamic table size update, or a literal field
+        byte = data[pos]
+        if byte & 0xe0 == 0x20:
+            size, pos = decode_integer(data, pos, 5)
+            if size > self.max_table_size:
+                raise HPACKError("Table size update too large")
+            self.table_size = size
+            self._shrink()
+            return None, pos
+
+        # literals: with incremental indexing, without indexing or never indexed
+        indexing = byte & 0xc0 == 0x40
+        index, pos = decode_integer(data, pos, 6 if indexing else 4)
+        if index:
+            name = self._lookup(index)[0]
+        else:
+            name, pos = decode_string(data, pos)
+        value, pos = decode_string(data, pos)
+
+        if indexing:
+            self._add(name, value)
+        return (name, value), pos
+
+class Encoder:
+    """Encodes header blocks using the static table only.
+
+    Nothing is added to the decoder's dynamic table, so the peer's table size
+    setting never needs to be tracked.
+    """
+
+    def encode(self, headers):
+        out = bytearray()
+        for name, value in headers:
+            index = STATIC_FIELDS.get((name, value))
+            if index:
+                out += encode_integer(index, 7, 0x80)
+                continue
+
+            index = STATIC_NAMES.get(name)
+            if index:
+                out += encode_integer(index, 4)
+            else:
+                out += b"\x00" + encode_string(name)
+            out += encode_string(value)
+
+        return bytes(out)
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import base64
+import socket
+import select
+import struct
+import threading
+from time import monotonic
+from datetime import datetime
+
+from __main__ import APP_NAME, APP_VERSION, PYTHON_VERSION
+from util import *
+from hpack import Encoder, Decoder, HPACKError, HeaderListTooLarge
+from request import Request
+from response import Response
+
+DATA          = 0x0
+HEADERS       = 0x1
+PRIORITY      = 0x2
+RST_STREAM    = 0x3
+SETTINGS      = 0x4
+PUSH_PROMISE  = 0x5
+PING          = 0x6
+GOAWAY        = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION  = 0x9
+
+END_STREAM  = 0x1
+ACK         = 0x1
+END_HEADERS = 0x4
+PADDED      = 0x8
+PRIORITY_FLAG = 0x20
+
+SETTINGS_HEADER_TABLE_SIZE      = 0x1
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE    = 0x4
+SETTINGS_MAX_FRAME_SIZE         = 0x5
+SETTINGS_MAX_HEADER_LIST_SIZE   = 0x6
+
+NO_ERROR           = 0x0
+PROTOCOL_ERROR     = 0x1
+INTERNAL_ERROR     = 0x2
+FLOW_CONTROL_ERROR = 0x3
+FRAME_SIZE_ERROR   = 0x6
+REFUSED_STREAM     = 0x7
+STREAM_CLOSED      = 0x5
+CANCEL             = 0x8
+COMPRESSION_ERROR  = 0x9
+
+DEFAULT_WINDOW = 65535
+DEFAULT_FRAME_SIZE = 16384
+MAX_WINDOW = 2 ** 31 - 1
+MAX_FRAME_SIZE = 2 ** 24 - 1
+
+# frames which always carry a payload of this many bytes
+FRAME_SIZES = {PRIORITY: 5, RST_STREAM: 4, PING: 8, WINDOW_UPDATE: 4}
+
+# headers which only make sense for a single HTTP/1 connection
+CONNECTION_HEADERS = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+class HTTP2Error(ProtocolError):
+
+    def __init__(self, code, message=""):
+        super().__init__(message)
+        self.code = code
+
+def is_h2c_upgrade(req):
+    return (req.get("Upgrade", "").lower() == "h2c" and "HTTP2-Settings" in req.headers
+            and "upgrade" in req.get("Connection", "").lower())
+
+class Stream:
+    """One HTTP/2 stream, which stands in for the socket of the response sent on it."""
+
+    __slots__ = ("id", "connection", "window", "headers", "body", "received", "deadline",
+                 "ended_remote", "ended_local", "reset", "timeout", "thread")
+    def __init__(self, connection, stream_id, window):
+        self.id = stream_id
+        self.connection = connection
+        self.window = window
+        self.headers = None
+        self.body = []
+        self.received = 0
+        self.deadline = None
+        self.ended_remote = False
+        self.ended_local = False
+        self.reset = False
+        self.timeout = connection.config.get("write_timeout", connection.config.get("timeout") or 15)
+        self.thread = None
+
+    def sendall(self, data):
+        self.connection.send_data(self, data)
+
+    def sendfile(self, fp, offset=0, count=None):
+        if count is None:
+            count = os.fstat(fp.fileno()).st_size - offset
+        self.connection.send_data(self, fp, offset, count)
+        return count
+
+    def expires(self, min_rate):
+        return self.deadline + (self.received / min_rate if min_rate else 0)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def end(self):
+        if not self.ended_local and not self.reset:
+            self.ended_local = True
+            self.connection.send_frame(DATA, END_STREAM, self.id)
+
+class HTTP2Response(Response):
+    """A response sent as HEADERS and DATA frames on a stream rather than written to the socket."""
+
+    __slots__ = ()
+    def __init__(self, req):
+        super().__init__(req)
+        self.conn = req.stream
+
+    def status(self, code):
+        if self.status_sent:
+            raise ProtocolError("The status code has already been sent!")
+
+        self.status_code = code
+        self.status_message = HTTP_CODES.get(code, "Unimplemented Status Code")
+        self.status_sent = True
+        print("send <{}:{}>: HTTP/2 {} {} (stream {})".format(
+            self.addr[0], self.addr[1], self.status_code, self.status_message, self.conn.id))
+        return self
+
+    def write_head(self, code=None, headers={}):
+        self.status_code = code or self.status_code
+        self.headers.update(headers)
+
+        if not self.status_sent:
+            self.status(self.status_code)
+
+        self.set_default("Server", "{}/{} python/{}".format(APP_NAME, APP_VERSION, PYTHON_VERSION))
+        self.set_default("Date", htmltime(datetime.utcnow()))
+
+        fields = [(b":status", str(self.status_code).encode("ascii"))]
+        for key, value in self.headers.items():
+            key = key.lower()
+            if key not in CONNECTION_HEADERS:
+                fields.append((key.encode("latin-1"), str(value).encode("latin-1")))
+
+        self.conn.connection.send_headers(self.conn, fields)
+        self.headers_sent = True
+        return self
+
+    def send_chunk(self, payload):
+        if not self.status_sent:
+            self.status(codes.OK)
+
+        if not self.headers_sent:
+            self.write_head()
+
+        if payload:
+            self.write(payload)
+        else:
+            self.conn.end()
+            self.body_sent = True
+
+    def send(self, payload=None):
+        super().send(payload)
+        self.conn.end()
+        return self
+
+    def send_stream(self, fp, length=None):
+        super().send_stream(fp, length)
+        self.conn.end()
+        return self
+
+    def end(self):
+        self.conn.end()
+
+class HTTP2Request(Request):
+    """A request received on an HTTP/2 stream, from its already decoded header fields."""
+
+    __slots__ = ("stream",)
+    response_class = HTTP2Response
+    def __init__(self, server, stream, fields, payload):
+        self.stream = stream
+        super().__init__(server)
+        self.timer.begin()
+        self.server.profiler.begin(self)
+        self.version = "2.0"
+        self.payload = payload
+
+        try:
+            pseudo = {}
+            cookies = []
+            for name, value in fields:
+                if name.startswith(b":"):
+                    pseudo[name] = value.decode("latin-1")
+                elif name == b"cookie":
+                    # HTTP/2 clients may split cookies across fields
+                    cookies.append(value)
+                else:
+                    self.headers.add(name, value)
+
+            if cookies:
+                self.headers.add(b"cookie", b"; ".join(cookies))
+
+            self.method = pseudo[b":method"]
+            self.fullpath = pseudo[b":path"]
+            if b":authority" in pseudo and "Host" not in self.headers:
+                self.headers.add(b"host", pseudo[b":authority"].encode("latin-1"))
+
+            self._parse_target()
+
+        except (KeyError, IndexError, ValueError, UnicodeDecodeError, AttributeError) as e:
+            try:
+                HTTPError(codes.BAD_REQUEST, "Malformed headers\r\n").handler(self, self.response)
+            except (ProtocolError, BrokenPipeError, OSError, socket.timeout) as e:
+                print(e, file=sys.stderr)
+            return
+
+        self.timer.mark("parse")
+        print("recv <{}:{}>: {} (stream {})".format(self.addr[0], self.addr[1], str(self), stream.id))
+        self.processed = True
+
+class HTTP2Connection:
+    """Speaks HTTP/2 over an HTTP connection, after prior knowledge or an h2c upgrade.
+
+    The connection's thread reads frames, and each request is handled on a
+    thread of its own once its stream ends, so many requests can be served
+    at once over the one connection. Responses wait for flow control window
+    before sending DATA.
+    """
+
+    def __init__(self, connection, buf=b''):
+        self.connection = connection
+        self.config = connection.config
+        self.sock = connection.conn
+        self.addr = connection.addr
+        self.buf = buf
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+        self.write_lock = threading.Lock()
+        self.flow = threading.Condition()
+        self.streams = {}
+        self.window = DEFAULT_WINDOW
+        self.initial_window = DEFAULT_WINDOW
+        self.max_frame_size = DEFAULT_FRAME_SIZE
+        self.max_streams = self.config.get("h2_max_streams", 100)
+        self.max_header_list = self.config.get("max_header_size", 65536)
+        self.last_stream = 0
+        self.header_block = None
+        self.header_deadline = None
+        self.closed = False
+
+        self.timeout = self.config.get("timeout") or 15
+        self.header_timeout = self.config.get("header_timeout", 10)
+        self.body_timeout = self.config.get("body_timeout", self.timeout)
+        self.min_body_rate = self.config.get("min_body_rate", 1024)
+
+    def send_frame(self, kind, flags, stream_id, payload=b''):
+        header = struct.pack(">I", len(payload))[1:] + struct.pack(">BBI", kind, flags, stream_id)
+        with self.write_lock:
+            self.sock.sendall(header + payload)
+
+    def send_headers(self, stream, fields, end_stream=False):
+        block = self.encoder.encode(fields)
+        frames = [block[i:i + self.max_frame_size] for i in range(0, len(block), self.max_frame_size)] or [b'']
+
+        # a header block has to be sent without any other frames in between
+        with self.write_lock:
+            for i, frame in enumerate(frames):
+                kind = HEADERS if i == 0 else CONTINUATION
+                flags = END_HEADERS if i == len(frames) - 1 else 0
+                if i == 0 and end_stream:
+                    flags |= END_STREAM
+                self.sock.sendall(struct.pack(">I", len(frame))[1:] + struct.pack(">BBI", kind, flags, stream.id) + frame)
+
+    def _reserve(self, stream, size):
+        with self.flow:
+            while not (stream.window > 0 and self.window > 0):
+                if stream.reset or self.closed:
+                    raise BrokenPipeError("Stream {} was closed".format(stream.id))
+                if not self.flow.wait(stream.timeout):
+                    raise socket.timeout("Timed out waiting for flow control window")
+
+            if stream.reset or self.closed:
+                raise BrokenPipeError("Stream {} was closed".format(stream.id))
+
+            size = min(size, stream.window, self.window, self.max_frame_size)
+            stream.window -= size
+            self.window -= size
+            return size
+
+    def send_data(self, stream, data, offset=0, count=None):
+        """Sends bytes, or `count` bytes of the file `data` from `offset`, as DATA frames."""
+        if count is None:
+            data = memoryview(data)
+            count = len(data)
+
+        sent = 0
+        while sent < count:
+            size = self._reserve(stream, count - sent)
+            header = struct.pack(">I", size)[1:] + struct.pack(">BBI", DATA, 0, stream.id)
+            with self.write_lock:
+                if type(data) == memoryview:
+                    self.sock.sendall(header + data[sent:sent + size])
+                else:
+                    self.sock.sendall(header)
+                    self.sock.sendfile(data, offset + sent, size)
+            sent += size
+
+    def _deadline(self):
+        # the earliest time by which a request still being received has to arrive
+        with self.flow:
+            deadlines = [s.expires(self.min_body_rate) for s in self.streams.values()
+                         if not s.ended_remote and s.deadline is not None]
+        if self.header_block is not None:
+            deadlines.append(self.header_deadline)
+        return min(deadlines, default=None)
+
+    def _expire(self):
+        now = monotonic()
+        if self.header_block is not None and now >= self.header_deadline:
+            raise socket.timeout("Timed out waiting for the rest of a header block")
+
+        with self.flow:
+            expired = [s for s in self.streams.values()
+                       if not s.ended_remote and s.deadline is not None and now >= s.expires(self.min_body_rate)]
+            for stream in expired:
+                stream.reset = True
+                del self.streams[stream.id]
+            self.flow.notify_all()
+
+        for stream in expired:
+            print("Stream {} timed out".format(stream.id), file=sys.stderr)
+            self.send_frame(RST_STREAM, 0, stream.id, struct.pack(">I", CANCEL))
+
+    def _recv(self, n):
+        # the socket's own timeout is left to writers, so reads wait with select
+        while len(self.buf) < n:
+            deadline = self._deadline()
+            wait = self.timeout if deadline is None else min(self.timeout, max(0, deadline - monotonic()))
+            if not select.select([self.sock], [], [], wait)[0]:
+                if deadline is not None and monotonic() >= deadline:
+                    self._expire()
+                elif not self.streams:
+                    raise socket.timeout("Connection idle for {} seconds".format(self.timeout))
+                # otherwise streams are still being served, so keep waiting
+                continue
+
+            data = self.sock.recv(65536)
+            if not data:
+                raise BrokenPipeError("Connection closed by peer")
+            self.buf += data
+
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def _read_frame(self):
+        header = self._recv(9)
+        length = int.from_bytes(header[:3], "big")
+        kind, flags, stream_id = struct.unpack(">BBI", header[3:])
+        if length > DEFAULT_FRAME_SIZE:
+            raise HTTP2Error(FRAME_SIZE_ERROR, "Frame too large")
+
+        return kind, flags, stream_id & 0x7fffffff, self._recv(length)
+
+    def _settings(self, payload):
+        if len(payload) % 6:
+            raise HTTP2Error(FRAME_SIZE_ERROR, "Invalid SETTINGS length")
+
+        for i in range(0, len(payload), 6):
+            key, value = struct.unpack(">HI", payload[i:i + 6])
+            if key == SETTINGS_INITIAL_WINDOW_SIZE:
+                if value > MAX_WINDOW:
+                    raise HTTP2Error(FLOW_CONTROL_ERROR, "Initial window too large")
+                with self.flow:
+                    for stream in self.streams.values():
+                        stream.window += value - self.initial_window
+                    self.initial_window = value
+                    self.flow.notify_all()
+            elif key == SETTINGS_MAX_FRAME_SIZE:
+                if not DEFAULT_FRAME_SIZE <= value <= MAX_FRAME_SIZE:
+                    raise HTTP2Error(PROTOCOL_ERROR, "Invalid maximum frame size")
+                self.max_frame_size = value
+
+    def _unpad(self, flags, payload):
+        if flags & PADDED:
+            if not payload or payload[0] >= len(payload):
+                raise HTTP2Error(PROTOCOL_ERROR, "Invalid padding")
+            pad = payload[0]
+            payload = payload[1:len(payload) - pad]
+        return payload
+
+    def _open(self, stream_id):
+        if stream_id % 2 == 0 or stream_id <= self.last_stream:
+            raise HTTP2Error(PROTOCOL_ERROR, "Invalid stream id {}".format(stream_id))
+
+        self.last_stream = stream_id
+        with self.flow:
+            if len(self.streams) >= self.max_streams:
+                self.send_frame(RST_STREAM, 0, stream_id, struct.pack(">I", REFUSED_STREAM))
+                return None
+
+            stream = self.streams[stream_id] = Stream(self, stream_id, self.initial_window)
+            return stream
+
+    def _headers(self, stream_id, flags, block):
+        too_large = False
+        try:
+            fields = self.decoder.decode(block, self.max_header_list)
+        except HeaderListTooLarge:
+            fields, too_large = None, True
+        except HPACKError as e:
+            raise HTTP2Error(COMPRESSION_ERROR, str(e))
+
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if stream_id % 2 and stream_id <= self.last_stream:
+                # trailers for a stream which was reset or already answered
+                self.send_frame(RST_STREAM, 0, stream_id, struct.pack(">I", STREAM_CLOSED))
+                return
+
+            stream = self._open(stream_id)
+            if stream is None: return
+            if too_large:
+                return self._reject(stream, codes.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            stream.headers = fields
+            stream.deadline = monotonic() + self.body_timeout
+        # otherwise these are trailers, which are dropped
+
+        if flags & END_STREAM and not stream.ended_remote:
+            self._dispatch(stream)
+
+    def _reject(self, stream, code):
+        # answers a stream with a bare status, without handing it to the router
+        print("send <{}:{}>: HTTP/2 {} {} (stream {})".format(
+            self.addr[0], self.addr[1], code, HTTP_CODES.get(code, ""), stream.id))
+        with self.flow:
+            stream.reset = True
+            self.streams.pop(stream.id, None)
+        self.send_headers(stream, [(b":status", str(code).encode("ascii"))], end_stream=True)
+
+    def _handle(self, kind, flags, stream_id, payload):
+        if self.header_block is not None and kind != CONTINUATION:
+            raise HTTP2Error(PROTOCOL_ERROR, "Expected CONTINUATION")
+        if kind in FRAME_SIZES and len(payload) != FRAME_SIZES[kind]:
+            raise HTTP2Error(FRAME_SIZE_ERROR, "Invalid frame length")
+        if kind in (DATA, HEADERS, PRIORITY, RST_STREAM, CONTINUATION) and stream_id == 0:
+            raise HTTP2Error(PROTOCOL_ERROR, "Frame requires a stream")
+        if kind in (SETTINGS, PING, GOAWAY) and stream_id != 0:
+            raise HTTP2Error(PROTOCOL_ERROR, "Frame must be sent on stream 0")
+        if kind in (DATA, RST_STREAM, WINDOW_UPDATE) and stream_id > self.last_stream:
+            raise HTTP2Error(PROTOCOL_ERROR, "Frame on an idle stream")
+
+        if kind == HEADERS:
+            payload = self._unpad(flags, payload)
+            if flags & PRIORITY_FLAG:
+                if len(payload) < 5:
+                    raise HTTP2Error(FRAME_SIZE_ERROR, "Invalid HEADERS length")
+                payload = payload[5:]
+            if flags & END_HEADERS:
+                self._headers(stream_id, flags, payload)
+            else:
+                self.header_block = (stream_id, flags, payload)
+                self.header_deadline = monotonic() + self.header_timeout
+
+        elif kind == CONTINUATION:
+            if self.header_block is None or self.header_block[0] != stream_id:
+                raise HTTP2Error(PROTOCOL_ERROR, "Unexpected CONTINUATION")
+            block_id, block_flags, block = self.header_block
+            block += payload
+            if len(block) > self.config.get("max_header_size", 65536):
+                raise HTTP2Error(PROTOCOL_ERROR, "Header block too large")
+            self.header_block = None if flags & END_HEADERS else (block_id, block_flags, block)
+            if flags & END_HEADERS:
+                self._headers(block_id, block_flags, block)
+
+        elif kind == DATA:
+            stream = self.streams.get(stream_id)
+            if len(payload):
+                # request bodies are read in full, so the window is handed straight back
+                self.send_frame(WINDOW_UPDATE, 0, 0, struct.pack(">I", len(payload)))
+                if stream and not flags & END_STREAM:
+                    self.send_frame(WINDOW_UPDATE, 0, stream_id, struct.pack(">I", len(payload)))
+
+            if stream is None or stream.ended_remote:
+                return True
+            stream.received += len(payload)
+            stream.body.append(self._unpad(flags, payload))
+            if flags & END_STREAM:
+                self._dispatch(stream)
+
+        elif kind == SETTINGS:
+            if flags & ACK and payload:
+                raise HTTP2Error(FRAME_SIZE_ERROR, "SETTINGS acknowledgement with a payload")
+            if not flags & ACK:
+                self._settings(payload)
+                self.send_frame(SETTINGS, ACK, 0)
+
+        elif kind == WINDOW_UPDATE:
+            increment = struct.unpack(">I", payload)[0] & 0x7fffffff
+            if not increment:
+                raise HTTP2Error(PROTOCOL_ERROR, "Window increment of zero")
+            overflow = False
+            with self.flow:
+                if stream_id == 0:
+                    self.window += increment
+                    if self.window > MAX_WINDOW:
+                        raise HTTP2Error(FLOW_CONTROL_ERROR, "Window too large")
+                elif stream_id in self.streams:
+                    stream = self.streams[stream_id]
+                    stream.window += increment
+                    if stream.window > MAX_WINDOW:
+                        # only the stream's own window is broken, so only it is reset
+                        stream.reset = overflow = True
+                        del self.streams[stream_id]
+                self.flow.notify_all()
+
+            if overflow:
+                self.send_frame(RST_STREAM, 0, stream_id, struct.pack(">I", FLOW_CONTROL_ERROR))
+
+        elif kind == RST_STREAM:
+            with self.flow:
+                stream = self.streams.get(stream_id)
+                if stream:
+                    stream.reset = True
+                self.flow.notify_all()
+
+        elif kind == PING:
+            if not flags & ACK:
+                self.send_frame(PING, ACK, 0, payload)
+
+        elif kind == GOAWAY:
+            if len(payload) < 8:
+                raise HTTP2Error(FRAME_SIZE_ERROR, "Invalid GOAWAY length")
+            return False
+
+        # PRIORITY, PUSH_PROMISE and unknown frames are ignored
+        return True
+
+    def _dispatch(self, stream):
+        stream.ended_remote = True
+        stream.thread = threading.Thread(target=self._serve, args=(stream,), daemon=True)
+        stream.thread.start()
+
+    def _serve(self, stream):
+        req = HTTP2Request(self.connection, stream, stream.headers, b''.join(stream.body))
+        stream.body = None
+        res = req.response
+        try:
+            if req:
+                self.connection.router(req, res)
+
+        finally:
+            req.timer.mark("handle")
+            try:
+                # a response cut short must not look complete
+                if not res.body_sent and not stream.reset:
+                    self.send_frame(RST_STREAM, 0, stream.id, struct.pack(">I", INTERNAL_ERROR))
+                else:
+                    stream.end()
+            except (BrokenPipeError, OSError, socket.timeout) as e:
+                print(e, file=sys.stderr)
+
+            with self.flow:
+                self.streams.pop(stream.id, None)
+                self.flow.notify_all()
+
+            if req:
+                self.connection.profiler.finish(req)
+            else:
+                self.connection.profiler.discard(req)
+
+    def upgrade(self, req):
+        """Switches an HTTP/1.1 request carrying `Upgrade: h2c` over, answering it on stream 1."""
+        settings = req.get("HTTP2-Settings")
+        try:
+            self._settings(base64.urlsafe_b64decode(settings + "=" * (-len(settings) % 4)))
+        except (ValueError, HTTP2Error):
+            raise HTTPError(codes.BAD_REQUEST, "Invalid HTTP2-Settings\r\n")
+
+        self.sock.sendall(b"HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n")
+        print("send <{}:{}>: HTTP/1.1 101 Switching Protocols".format(self.addr[0], self.addr[1]))
+
+        self.last_stream = 1
+        stream = self.streams[1] = Stream(self, 1, self.initial_window)
+        stream.headers = [
+            (b":method", req.method.encode("ascii")),
+            (b":path", req.fullpath.encode("latin-1")),
+            (b":scheme", b"http")
+        ] + [(k, v) for k, v in req.headers.raw.items() if k.decode("latin-1") not in CONNECTION_HEADERS + ("http2-settings",)]
+        stream.body = [req.payload]
+        return stream
+
+    def run(self, upgrade=None):
+        settings = (struct.pack(">HI", SETTINGS_MAX_CONCURRENT_STREAMS, self.max_streams)
+                    + struct.pack(">HI", SETTINGS_MAX_HEADER_LIST_SIZE, self.max_header_list))
+        stream = None
+
+        try:
+            if upgrade:
+                try:
+                    stream = self.upgrade(upgrade)
+                except HTTPError as e:
+                    upgrade.response.set("Connection", "close")
+                    e.handler(upgrade, upgrade.response)
+                    return
+
+            self.send_frame(SETTINGS, 0, 0, settings)
+            if stream:
+                self._dispatch(stream)
+
+            if self._recv(len(HTTP2_PREFACE)) != HTTP2_PREFACE:
+                raise HTTP2Error(PROTOCOL_ERROR, "Invalid connection preface")
+
+            while True:
+                if not self._handle(*self._read_frame()):
+                    break
+
+            self._goaway(NO_ERROR)
+
+        except HTTP2Error as e:
+            print(e, file=sys.stderr)
+            self._goaway(e.code)
+
+        except socket.timeout as e:
+            print(e, file=sys.stderr)
+            self._goaway(NO_ERROR)
+
+        except (ProtocolError, BrokenPipeError, OSError) as e:
+            print(e, file=sys.stderr)
+
+        finally:
+            with self.flow:
+                self.closed = True
+                self.flow.notify_all()
+                streams = list(self.streams.values())
+
+            for stream in streams:
+                if stream.thread:
+                    stream.thread.join(stream.timeout)
+
+    def _goaway(self, code):
+        try:
+            self.send_frame(GOAWAY, 0, 0, struct.pack(">II", self.last_stream, code))
+        except (BrokenPipeError, OSError, socket.timeout):
+            pass
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import threading
+from time import perf_counter
+
+from util import *
+
+# stands in for a cProfile.Profile on requests sampled through tracemalloc
+TRACEMALLOC_SAMPLE = "tracemalloc"
+
+class PhaseTimer:
+    """Records how long each phase of a single request took.
+
+    The timer starts when the first byte of the request arrives, so time spent
+    idle on a keep-alive connection is not counted against the request.
+    """
+
+    __slots__ = ("start", "last", "phases")
+    def __init__(self):
+        self.start = None
+        self.last = None
+        self.phases = {}
+
+    def reset(self):
+        self.start = None
+        self.last = None
+        self.phases.clear()
+
+    def begin(self):
+        if self.start is None:
+            self.start = self.last = perf_counter()
+
+    def mark(self, phase):
+        if self.start is None: return
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def total(self):
+        if self.start is None: return 0.0
+        return self.last - self.start
+
+    def __str__(self):
+        return " ".join("{}={:.1f}ms".format(k, v * 1000) for k, v in self.phases.items())
+
+class Profiler:
+    """Logs slow requests and, when armed, samples requests through cProfile or tracemalloc.
+
+    While disarmed, the only cost on the request path is a single attribute check.
+    """
+
+    armed = False
+    def __init__(self, config):
+        self.threshold = config.get("slow_request_threshold")
+        self.mode = config.get("profile_mode", "cprofile")
+        self.samples = config.get("profile_samples", 100)
+        self.output = config.get("profile_output", "snakeserver-{pid}-{time}")
+        self.lock = threading.Lock()
+        self.stats = None
+        self.remaining = 0
+        self.pending = 0
+
+    def arm(self, samples=None):
+        with self.lock:
+            if self.armed:
+                return False
+
+            self.remaining = self.pending = samples or self.samples
+            self.stats = None
+            if self.mode == "tracemalloc":
+                import tracemalloc
+                tracemalloc.start()
+
+            self.armed = True
+            print("prof: sampling {} requests ({})".format(self.remaining, self.mode), file=sys.stderr)
+            return True
+
+    def begin(self, req):
+        if not self.armed:
+            return
+
+        with self.lock:
+            if not self.armed or self.remaining <= 0:
+                return
+            self.remaining -= 1
+
+        if self.mode == "tracemalloc":
+            req.profile = TRACEMALLOC_SAMPLE
+            return
+
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another thread is already being profiled, give the sample back
+            with self.lock:
+                self.remaining += 1
+            return
+
+        req.profile = profile
+
+    def finish(self, req):
+        timer = req.timer
+        if self.threshold and timer.total() >= self.threshold:
+            print("slow <{}:{}>: {} {:.1f}ms ({})".format(
+                req.addr[0], req.addr[1], str(req), timer.total() * 1000, timer), file=sys.stderr)
+
+        profile = req.profile
+        if profile is None:
+            return
+        req.profile = None
+
+        if self.mode == "cprofile":
+            profile.disable()
+            import pstats
+
+        with self.lock:
+            # the last sample may have been written while this one finished
+            if not self.armed or self.pending <= 0:
+                return
+
+            if self.mode == "cprofile":
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+            self._finish_sample()
+
+    def discard(self, req):
+        """Gives back the sample taken by a request which was never routed."""
+        profile = req.profile
+        if profile is None:
+            return
+        req.profile = None
+
+        if self.mode == "cprofile":
+            profile.disable()
+        with self.lock:
+            if self.armed:
+                self.remaining += 1
+
+    def _finish_sample(self):
+        self.pending -= 1
+        if self.pending > 0:
+            return
+
+        filename = self.output.format(pid=os.getpid(), time=int(time.time()))
+        try:
+            if self.mode == "tracemalloc":
+                import tracemalloc
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                filename += ".txt"
+                with open(filename, "w") as fp:
+                    for stat in snapshot.statistics("lineno")[:100]:
+                        print(stat, file=fp)
+            else:
+                filename += ".prof"
+                self.stats.dump_stats(filename)
+
+            print("prof: wrote {}".format(filename), file=sys.stderr)
+
+        except OSError as e:
+            print(e, file=sys.stderr)
+
+        finally:
+            self.stats = None
+            self.armed = False
+
+    def route(self, req, res):
+        if req.addr[0] not in ("127.0.0.1", "::1", "::ffff:127.0.0.1", "unix"):
+            raise HTTPError(codes.FORBIDDEN)
+
+        samples = None
+        if req.query:
+            try:
+                samples = int(req.query)
+            except ValueError:
+                pass
+
+        started = self.arm(samples)
+        res.set("Content-Type", "application/json")
+        res.status(202 if started else 409).send(json.dumps({
+            "mode": self.mode,
+            "samples": self.pending,
+            "started": started
+        }))
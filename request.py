@@ -2,94 +2,183 @@
 
 import sys
 import socket
+from time import monotonic
 from urllib.parse import urlparse, unquote
 
 from util import *
 from response import Response
+from profiling import PhaseTimer
+
+def _negotiation(header):
+    def get(self):
+        value = self._negotiations.get(header)
+        if value is None:
+            value = self._negotiations[header] = HTTPNegotiation(self.headers.get(header))
+        return value
+
+    return property(get)
 
 class Request:
+    """A single HTTP request received over a connection.
 
+    One instance is created per connection and reused for every request
+    received on it with `receive`.
+    """
+
+    __slots__ = ("server", "config", "conn", "addr", "timer", "profile", "response",
+                 "method", "fullpath", "base", "path", "query", "fragment", "version",
+                 "raw", "payload", "host", "port", "url", "headers", "processed",
+                 "_negotiations")
+    response_class = Response
     def __init__(self, server):
         self.server = server
         self.config = server.config
         self.conn = server.conn
         self.addr = server.addr
-        self.response = Response(self)
+        self.timer = PhaseTimer()
+        self.headers = Headers()
+        self._negotiations = {}
+        self.response = self.response_class(self)
+        self.reset()
+
+    def reset(self):
+        self.timer.reset()
+        self.headers.clear()
+        self._negotiations.clear()
+        self.response.reset()
+        self.profile = None
         self.method = None
         self.fullpath = None
         self.base = None
         self.path = None
+        self.query = None
+        self.fragment = None
         self.version = "1.0"
         self.raw = b''
         self.payload = b''
         self.host = ""
         self.port = -1
-        self.headers = {}
+        self.url = None
 
         self.processed = False
 
+    def receive(self):
+        self.reset()
+        self.conn.settimeout(self.config.get("timeout") or 15)
+
         try:
             req = self._recv_request()
-            if not req: return
+            if not req: return self
+            self.timer.mark("recv")
+
+            if req == HTTP2_PREFACE_LINE:
+                # the client wants HTTP/2 without upgrading, which the connection takes over
+                self.method, self.version = "PRI", "2.0"
+                return self
 
             success = self._parse_headers(req)
-            if not success: return
+            if not success: return self
+            self.timer.mark("parse")
 
             if "Content-Length" in self.headers:
                 success = self._recv_payload()
-                if self.get("Content-Length") != "0" and not success: return
+                if self.get("Content-Length") != "0" and not success: return self
+                self.timer.mark("payload")
 
         except ProtocolError:
-            return
+            return self
 
         except (BrokenPipeError, OSError, socket.timeout) as e:
             print(e, file=sys.stderr)
-            return
+            return self
 
         except HTTPError as e:
-            e.handler(self, self.response)
-            return
+            try:
+                e.handler(self, self.response)
+            except (ProtocolError, BrokenPipeError, OSError, socket.timeout) as e:
+                print(e, file=sys.stderr)
+            return self
 
         print("recv <{}:{}>: {}".format(self.addr[0], self.addr[1], str(self)))
         self.processed = True
+        return self
+
+    accept_encodings = _negotiation("Accept-Encoding")
+    accept_formats   = _negotiation("Accept")
+    accept_charsets  = _negotiation("Accept-Charset")
+    accept_languages = _negotiation("Accept-Language")
+    accept_te        = _negotiation("TE")
 
     def get(self, key, default=None):
-        if key in self.headers:
-            return self.headers[key]
-        else:
-            return default
+        return self.headers.get(key, default)
 
-    def consume(self, until=None, max_length=-1, buffer_size=4096):
+    def consume(self, until=None, max_length=-1, buffer_size=4096, deadline=None, limit=None, min_rate=0):
+        """Reads from the connection until `until` matches, `max_length` bytes arrive or the peer closes.
+
+        Reading past `deadline` (a `time.monotonic` value), or for more than
+        `limit` seconds after the first byte arrives, raises a 408. The
+        deadline is extended by a second for every `min_rate` bytes received.
+        """
         buf = b''
         if type(until) in (bytes, str):
             until = re.compile(until)
-        until_cond = lambda: not until or (not until.search(buf))
-        len_cond = lambda: max_length == -1 or len(buf) < max_length
 
-        while until_cond() and len_cond():
+        timeout = self.conn.gettimeout()
+        while not (until and until.search(buf)) and (max_length == -1 or len(buf) < max_length):
+            if deadline is not None:
+                expires = deadline + (len(buf) / min_rate if min_rate else 0)
+                remaining = expires - monotonic()
+                if remaining <= 0:
+                    raise HTTPError(codes.REQUEST_TIMEOUT)
+                self.conn.settimeout(min(remaining, timeout) if timeout else remaining)
+
+            size = buffer_size if max_length == -1 else min(buffer_size, max_length - len(buf))
             try:
-                new_data = self.conn.recv(buffer_size)
-            except (BrokenPipeError, OSError, socket.timeout) as e:
+                new_data = self.conn.recv(size)
+            except socket.timeout as e:
+                if deadline is not None and monotonic() >= expires:
+                    raise HTTPError(codes.REQUEST_TIMEOUT)
                 print(e, file=sys.stderr)
                 return b''
+            except (BrokenPipeError, OSError) as e:
+                print(e, file=sys.stderr)
+                return b''
+            finally:
+                if deadline is not None:
+                    self.conn.settimeout(timeout)
 
             # print("Got data: {}".format(new_data)) # don't remove
-            buf += new_data
-            if not new_data or (max_length != -1 and len(new_data) < buffer_size):
+            if not new_data:
                 break
 
+            if self.timer.start is None:
+                self.timer.begin()
+                self.server.profiler.begin(self)
+            if limit and deadline is None:
+                deadline = monotonic() + limit
+            buf += new_data
+
         return buf
 
     def _recv_request(self):
-        req = self.consume(until=BLANK_LINE_RE)
+        max_request_line = self.config.get("max_request_line", 8190)
+        max_header_size = self.config.get("max_header_size", 65536)
+        req = self.consume(until=BLANK_LINE_RE, max_length=max_header_size + 1,
+                limit=self.config.get("header_timeout", 10))
         if not req: return None
         self.raw += req
 
         payload = b''
         if BLANK_LINE_RE.search(req):
             req, payload = BLANK_LINE_RE.split(req, 1)
-        self.payload += payload
 
+        line_end = NEWLINE_RE.search(req)
+        if (line_end.start() if line_end else len(req)) > max_request_line:
+            raise HTTPError(codes.REQUEST_URI_TOO_LONG)
+        if len(req) > max_header_size:
+            raise HTTPError(codes.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        self.payload += payload
         return req
 
     def _recv_payload(self):
@@ -101,7 +190,10 @@ class Request:
         except ValueError:
             raise HTTPError(codes.BAD_REQUEST, "Invalid Content-Length\r\n")
 
-        new_data = self.consume(max_length=max(-1, content_length - len(self.payload)))
+        # slow bodies get `body_timeout` seconds of grace, then must keep up `min_body_rate`
+        deadline = monotonic() + self.config.get("body_timeout", self.config.get("timeout") or 15)
+        new_data = self.consume(max_length=max(-1, content_length - len(self.payload)),
+                deadline=deadline, min_rate=self.config.get("min_body_rate", 1024))
         self.raw += new_data
         self.payload += new_data
 
@@ -118,41 +210,37 @@ class Request:
             if not self.version:
                 self.version = "1.0"
 
-            urlparts = urlparse(self.fullpath)
-            getpart = lambda name: unquote(getattr(urlparts, name))
-            self.path, self.query, self.fragment = \
-                getpart("path"), getpart("query"), getpart("fragment")
-
-            self.headers = {}
-            for line in lines[1:]:
-                if not line: break
-                key, value = re.split(rb': *', line, 1)
-                self.headers[key.title().decode("ascii")] = value.decode("ascii")
+            self.headers.parse(lines[1:])
 
             if self.version >= "1.1" and "Host" not in self.headers:
                 raise HTTPError(codes.BAD_REQUEST, "Host header required\r\n")
 
-            host = self.headers.get("Host", ":".join(map(str, self.conn.getsockname())))
-            if ":" not in host:
-                host += ":80"
-
-            self.host, self.port = host.split(":", 1)
-            self.port = int(self.port)
-
-            port_url = ":{}".format(self.port) if self.port != 80 else ""
-            self.url = "http://" + self.host + port_url + self.fullpath
-
-            self.accept_encodings = HTTPNegotiation(self.get("Accept-Encoding"))
-            self.accept_formats   = HTTPNegotiation(self.get("Accept"))
-            self.accept_charsets  = HTTPNegotiation(self.get("Accept-Charset"))
-            self.accept_languages = HTTPNegotiation(self.get("Accept-Language"))
-            self.accept_te        = HTTPNegotiation(self.get("TE"))
+            self._parse_target()
 
         except (IndexError, ValueError, UnicodeDecodeError, AttributeError) as e:
             raise HTTPError(codes.BAD_REQUEST, "Malformed headers\r\n")
 
         return True
 
+    def _parse_target(self):
+        urlparts = urlparse(self.fullpath)
+        self.path = unquote(urlparts.path)
+        self.query = unquote(urlparts.query)
+        self.fragment = unquote(urlparts.fragment)
+
+        host = self.headers.get("Host")
+        if host is None:
+            sockname = self.conn.getsockname()
+            host = ":".join(map(str, sockname[:2])) if type(sockname) == tuple else "localhost"
+        if ":" not in host:
+            host += ":80"
+
+        self.host, self.port = host.split(":", 1)
+        self.port = int(self.port)
+
+        port_url = ":{}".format(self.port) if self.port != 80 else ""
+        self.url = "http://" + self.host + port_url + self.fullpath
+
     def __str__(self):
         if self.method and self.fullpath:
             return "{} {} HTTP/{}".format(self.method, self.fullpath, self.version)
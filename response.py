@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
 import os
+import socket
 import mimetypes
+from time import perf_counter
 mimetypes.init()
 from datetime import datetime
 
 from __main__ import APP_NAME, APP_VERSION, PYTHON_VERSION
 from util import *
+from shaping import shaped
+
+# the most sent by one sendfile call between checks of a response's deadline
+SENDFILE_CHUNK = 1024 * 1024
 
 class Response:
 
+    __slots__ = ("server", "config", "request", "conn", "addr", "headers",
+                 "status_code", "status_message", "status_sent", "headers_sent", "body_sent", "limits")
     def __init__(self, req):
         self.server = req.server
         self.config = req.config
@@ -17,6 +25,16 @@ class Response:
         self.conn = req.conn
         self.addr = req.addr
         self.headers = {}
+        self.limits = []
+        self.reset()
+
+    def reset(self):
+        self.headers.clear()
+        self.limits.clear()
+        if self.server.rate_limit:
+            self.limits.append(self.server.rate_limit)
+        self.status_code = None
+        self.status_message = None
         self.status_sent = False
         self.headers_sent = False
         self.body_sent = False
@@ -41,9 +59,23 @@ class Response:
         if type(msg) == str:
             msg = msg.encode(self.config.get("charset") or "utf-8")
 
-        self.conn.sendall(msg)
+        self._sendall(msg)
         return len(msg)
 
+    def _sendall(self, data):
+        # sendall's timeout covers the whole call, so allow for `min_send_rate` on top
+        timeout = self.conn.gettimeout()
+        write_timeout = self.config.get("write_timeout", self.config.get("timeout") or 15)
+        min_rate = self.config.get("min_send_rate", 1024)
+        self.conn.settimeout(write_timeout + (len(data) / min_rate if min_rate else 0))
+
+        t = perf_counter()
+        try:
+            self.conn.sendall(data)
+        finally:
+            self.request.timer.add("send", perf_counter() - t)
+            self.conn.settimeout(timeout)
+
     def write_head(self, code=None, headers={}):
         self.status_code = code or self.status_code
         self.headers.update(headers)
@@ -87,11 +119,13 @@ class Response:
 
             self.write_head()
 
-        self.write(hex(len(payload)))
-        self.write("\r\n")
+        self.write("{:x}\r\n".format(len(payload)))
         self.write(payload)
         self.write("\r\n")
 
+        if not payload:
+            self.body_sent = True
+
     def send(self, payload=None):
         if self.body_sent:
             raise ProtocolError("The message has already been sent!")
@@ -110,13 +144,60 @@ class Response:
             if type(payload) == str:
                 payload = payload.encode(self.config.get("encoding") or "utf-8")
 
-            self.conn.sendall(payload)
+            if self.limits:
+                payload = memoryview(payload)
+                for start, size in shaped(self.limits, len(payload), self.config.get("rate_limit_after", 1048576)):
+                    self._sendall(payload[start:start + size])
+            else:
+                self._sendall(payload)
             print("send <{}:{}>: {} {} bytes".format(
                 self.addr[0], self.addr[1], self.headers.get("Content-Type"), self.headers.get("Content-Length")))
 
         self.body_sent = True
         return self
 
+    def send_stream(self, fp, length=None):
+        if self.body_sent:
+            raise ProtocolError("The message has already been sent!")
+
+        offset = fp.tell()
+        if length is None:
+            length = os.fstat(fp.fileno()).st_size - offset
+
+        if not self.status_sent:
+            self.status(codes.OK)
+
+        if not self.headers_sent:
+            self.set_default("Content-Length", length)
+            self.write_head()
+
+        # sendfile applies the timeout to each wait, so the total time spent sending is
+        # checked between bounded calls, as in `_sendall`. Shaping delays don't count.
+        timeout = self.conn.gettimeout()
+        write_timeout = self.config.get("write_timeout", self.config.get("timeout") or 15)
+        min_rate = self.config.get("min_send_rate", 1024)
+        remaining = write_timeout + (length / min_rate if min_rate else 0)
+
+        t = perf_counter()
+        try:
+            for start, size in shaped(self.limits, length, self.config.get("rate_limit_after", 1048576)):
+                for pos in range(start, start + size, SENDFILE_CHUNK):
+                    if remaining <= 0:
+                        raise socket.timeout("Timed out sending {} bytes".format(length))
+                    self.conn.settimeout(min(write_timeout, remaining))
+
+                    started = perf_counter()
+                    self.conn.sendfile(fp, offset + pos, min(SENDFILE_CHUNK, start + size - pos))
+                    remaining -= perf_counter() - started
+        finally:
+            self.request.timer.add("send", perf_counter() - t)
+            self.conn.settimeout(timeout)
+        print("send <{}:{}>: {} {} bytes".format(
+            self.addr[0], self.addr[1], self.headers.get("Content-Type"), length))
+
+        self.body_sent = True
+        return self
+
     def send_file(self, filename):
         mime, encoding = mimetypes.guess_type(filename)
         modtime = datetime.fromtimestamp(int(os.path.getmtime(filename)))
@@ -133,6 +214,7 @@ class Response:
         encodings = [None]
         if self.config.get("gzip"):
             encodings.append("gzip")
+            self.set("Vary", "Accept-Encoding")
 
         if self.request.accept_encodings:
             encoding = self.request.accept_encodings.negotiate(encodings[::-1])
@@ -145,12 +227,16 @@ class Response:
         if self.request.method == "GET":
             if encoding == "gzip":
                 import gzip
+                t = perf_counter()
                 with open(filename, "rb") as fp:
-                    self.send(gzip.compress(fp.read()))
+                    payload = fp.read()
+                self.request.timer.add("fs", perf_counter() - t)
+
+                self.send(gzip.compress(payload))
 
             else:
                 with open(filename, "rb") as fp:
-                    self.send(fp.read())
+                    self.send_stream(fp)
         else:
             self.send()
 
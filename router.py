@@ -4,14 +4,15 @@ import os
 import sys
 import socket
 import mimetypes
+from time import perf_counter
 mimetypes.init()
 from urllib.parse import urlparse
 
 from util import *
 
 PARAM_RE      = re.compile(r':([^:/]+)')
-PARAM_SUB     = r'(?P\1[^/]+)'
-RE_ESCAPE_RE  = re.compile(r'[\-\.]')
+PARAM_SUB     = r'(?P<\1>[^/]+)'
+RE_ESCAPE_RE  = re.compile(r'([\-\.])')
 RE_ESCAPE_SUB = r'\\\1'
 SLASH_RE      = re.compile(r'/')
 EMPTY_RE      = re.compile(r'')
@@ -25,15 +26,17 @@ def path_to_regexp(s):
 
     return re.compile("^/?" + "/".join(parts))
 
-def static(static_prefix):
+def static(static_prefix, rate_limit=None, autoindex=None):
     def handle(req, res):
         if req.method in ("GET", "HEAD"):
+            t = perf_counter()
             static_path = os.path.join(*urlparse(req.path).path.split("/"))
             path = os.path.join(static_prefix, static_path)
 
             if os.path.isdir(path):
-                if not req.fullpath.endswith("/"):
-                    res.redirect(req.fullpath + "/")
+                target = urlparse(req.fullpath)
+                if not target.path.endswith("/"):
+                    res.redirect(target._replace(path=target.path + "/").geturl())
                     return
 
                 for poss in req.config.get("index", ["index.html", "index.htm"]):
@@ -41,9 +44,16 @@ def static(static_prefix):
                     if os.path.isfile(newpath):
                         path = newpath
 
-            if not os.path.isfile(path):
+            found = os.path.isfile(path)
+            listing = not found and autoindex and os.path.isdir(path)
+            req.timer.add("fs", perf_counter() - t)
+            if listing:
+                return autoindex(req, res, path)
+            if not found:
                 return True
 
+            if rate_limit:
+                res.limits.append(rate_limit)
             res.send_file(path)
         else:
             res.set("Allow", "GET, HEAD")
@@ -56,6 +66,7 @@ def not_found(req, res):
 
 class Route:
 
+    __slots__ = ("method", "pattern", "func")
     def __init__(self, method, pattern, f):
         self.method = method
         if pattern is None:
@@ -92,11 +103,12 @@ HTTP_METHODS = [
 
 class Router:
 
-    stack = []
-    error_handlers = []
     def __init__(self):
+        self.stack = []
+        self.error_handlers = []
+
         def _method_gen(method):
-            def method_use(self, path, f=None):
+            def method_use(path, f=None):
                 if not f:
                     f = path
                     path = None
@@ -128,10 +140,10 @@ class Router:
         if req.headers.get("Connection", "").lower() == "close":
             res.set("Connection", "close")
         if req.headers.get("Connection", "").lower() == "keep-alive":
-            req.conn.settimeout(None)
             res.set("Connection", "keep-alive")
 
         matches = [r for r in self.stack if r.matches(req)]
+        req.timer.mark("match")
 
         try:
             if req.method not in HTTP_METHODS:
@@ -1,30 +1,128 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import stat
 import socket
 import threading
 
 from util import *
 from connection import HTTPConnection
+from profiling import Profiler
+from wsgi import WSGIApplication
+from cache import ResponseCache
+from shaping import TokenBucket
+from autoindex import DirectoryIndex
+
+SD_LISTEN_FDS_START = 3
+
+def inherited_socket(which):
+    """Returns a listening socket passed in by systemd socket activation.
+
+    `which` is either the index of the socket or its name in LISTEN_FDNAMES.
+    """
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        raise ValueError("No sockets were passed to this process")
+
+    count = int(os.environ.get("LISTEN_FDS", 0))
+    if type(which) == str:
+        names = os.environ.get("LISTEN_FDNAMES", "").split(":")
+        if which not in names:
+            raise ValueError("No socket named {} was passed to this process".format(which))
+        which = names.index(which)
+
+    if not 0 <= which < count:
+        raise ValueError("Socket {} was not passed to this process ({} sockets)".format(which, count))
+
+    return socket.socket(fileno=SD_LISTEN_FDS_START + which)
 
 class TCPServer:
 
     closed = False
+    unix_path = None
     def __init__(self, config):
         self.config = config
-        af = socket.AF_INET6 if config.get("ipv6", False) else socket.AF_INET
-        self.sock = socket.socket(af, socket.SOCK_STREAM)
+        host = config.get("host", "")
+        if config.get("listen_fd") is not None:
+            self.sock = inherited_socket(config.get("listen_fd"))
+        elif host.startswith("unix:"):
+            self.unix_path = host[len("unix:"):]
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            af = socket.AF_INET6 if config.get("ipv6", False) else socket.AF_INET
+            self.sock = socket.socket(af, socket.SOCK_STREAM)
+        self.tcp = self.sock.family in (socket.AF_INET, socket.AF_INET6)
         self.connections = []
+        self.profiler = Profiler(config)
+        self.cache = ResponseCache(config)
+        self.wsgi_apps = {}
+        self.rate_limits = {}
+        self.autoindexes = {}
+        for mountpoint, conf in config.get("locations", {}).items():
+            if conf.get("wsgi"):
+                self.wsgi_apps[mountpoint] = WSGIApplication(conf.get("wsgi"), conf)
+            if conf.get("rate_limit"):
+                self.rate_limits[mountpoint] = TokenBucket(conf.get("rate_limit"))
+            if conf.get("autoindex"):
+                self.autoindexes[mountpoint] = DirectoryIndex(conf)
+
         self.thread = threading.Thread(target=self._worker)
         self.thread.start()
         print("Started server")
 
+    def _setsockopt(self, sock, level, option, value):
+        try:
+            sock.setsockopt(level, option, value)
+        except OSError as e:
+            print("Could not set socket option {}: {}".format(option, e), file=sys.stderr)
+
+    def _tune(self, sock):
+        config = self.config
+        if config.get("send_buffer"):
+            self._setsockopt(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, config.get("send_buffer"))
+        if config.get("receive_buffer"):
+            self._setsockopt(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, config.get("receive_buffer"))
+
+        if not self.tcp:
+            return
+
+        if config.get("tcp_nodelay"):
+            self._setsockopt(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if config.get("tcp_defer_accept") and hasattr(socket, "TCP_DEFER_ACCEPT"):
+            self._setsockopt(sock, socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, config.get("tcp_defer_accept"))
+        if config.get("tcp_fastopen") and hasattr(socket, "TCP_FASTOPEN"):
+            self._setsockopt(sock, socket.IPPROTO_TCP, socket.TCP_FASTOPEN, config.get("tcp_fastopen"))
+
+    def _listen(self):
+        self._tune(self.sock)
+        if self.config.get("listen_fd") is not None:
+            return
+
+        if self.unix_path:
+            try:
+                if stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                    os.remove(self.unix_path)
+            except FileNotFoundError:
+                pass
+
+            self.sock.bind(self.unix_path)
+            if self.config.get("unix_mode"):
+                os.chmod(self.unix_path, int(str(self.config.get("unix_mode")), 8))
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((self.config.get("host", ""), self.config.get("port", 80)))
+
+        self.sock.listen(self.config.get("backlog", self.config.get("max_connections", 32)))
+
     def _worker(self):
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((self.config.get("host", ""), self.config.get("port", 80)))
-        self.sock.listen(self.config.get("max_connections", 32))
+        self._listen()
 
         while True:
             conn, addr = self.sock.accept()
+            if not self.tcp:
+                addr = ("unix", self.unix_path or "")
+            elif self.config.get("tcp_nodelay"):
+                self._setsockopt(conn, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
             if len(self.connections) < self.config.get("max_connections", 32):
                 self.connections.append(HTTPConnection(self, (conn, addr)))
@@ -42,7 +140,15 @@ class TCPServer:
         if not self.closed:
             for conn in self.connections:
                 if conn: conn.close()
+            for app in self.wsgi_apps.values():
+                app.close()
+            self.cache.close()
             self.sock.close()
+            if self.unix_path:
+                try:
+                    os.remove(self.unix_path)
+                except OSError:
+                    pass
             self.closed = True
 
     def __bool__(self):
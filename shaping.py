@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+from time import monotonic
+
+MIN_CHUNK = 4096
+MAX_CHUNK = 65536
+
+class TokenBucket:
+    """Limits the transfers through it to `rate` bytes a second.
+
+    Senders reserve a chunk at a time and may go into debt, sleeping until
+    it is paid off. Reservations are served in the order they were made, so
+    transfers sharing a bucket take turns and split the rate evenly.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "lock")
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.stamp = monotonic()
+        self.lock = threading.Lock()
+
+    def chunk_size(self):
+        return max(MIN_CHUNK, min(MAX_CHUNK, self.rate // 20))
+
+    def reserve(self, n):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+def shaped(limits, length, allowance=0):
+    """Splits a body of `length` bytes into (offset, size) spans to send.
+
+    The first `allowance` bytes are sent at once. The rest are sent in chunks,
+    sleeping before each one as long as the slowest of `limits` requires.
+    """
+    if not limits or length <= allowance:
+        yield 0, length
+        return
+
+    if allowance > 0:
+        yield 0, allowance
+
+    offset = max(allowance, 0)
+    chunk = min(limit.chunk_size() for limit in limits)
+    while offset < length:
+        size = min(chunk, length - offset)
+        delay = max(limit.reserve(size) for limit in limits)
+        if delay:
+            time.sleep(delay)
+
+        yield offset, size
+        offset += size
@@ -60,6 +60,7 @@ HTTP_CODES = {
     416: "Range Not Satisfiable",
     417: "Expectation Failed",
     426: "Upgrade Required",
+    431: "Request Header Fields Too Large",
     500: "Internal Server Error",
     501: "Not Implemented",
     502: "Bad Gateway",
@@ -72,6 +73,9 @@ NEWLINE_RE     = re.compile(rb'\r?\n')
 BLANK_LINE_RE  = re.compile(rb'\r?\n\r?\n')
 COMMA_RE       = re.compile(r', *')
 SEMICOLON_RE   = re.compile(r'; *')
+HEADER_SEP_RE  = re.compile(rb': *')
+HTTP2_PREFACE_LINE = b"PRI * HTTP/2.0"
+HTTP2_PREFACE  = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
 
 codes = determine_status_codes()
 
@@ -172,6 +176,53 @@ class HTTPNegotiation:
     def __bool__(self):
         return not self.missing
 
+class Headers:
+    """Request headers, indexed by lower-cased name as they arrive but only decoded when read."""
+
+    __slots__ = ("raw", "decoded")
+    def __init__(self):
+        self.raw = {}
+        self.decoded = {}
+
+    def parse(self, lines):
+        for line in lines:
+            if not line: break
+            key, value = HEADER_SEP_RE.split(line, 1)
+            self.raw[key.lower()] = value
+
+    def add(self, key, value):
+        self.raw[key.lower()] = value
+
+    def clear(self):
+        self.raw.clear()
+        self.decoded.clear()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        for name in self:
+            yield name, self[name]
+
+    def __getitem__(self, key):
+        value = self.decoded.get(key)
+        if value is None:
+            value = self.raw[key.lower().encode("latin-1")].decode("latin-1")
+            self.decoded[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key.lower().encode("latin-1") in self.raw
+
+    def __iter__(self):
+        return (key.decode("latin-1").title() for key in self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
 
 def htmltime(dt):
     return dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
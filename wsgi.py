@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import queue
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError
+
+from util import *
+
+QUEUE_SIZE = 16
+
+def load_app(spec):
+    """Imports a WSGI callable given as "module:attribute"."""
+    module, _, attr = spec.partition(":")
+    app = importlib.import_module(module)
+    for name in (attr or "application").split("."):
+        app = getattr(app, name)
+
+    return app
+
+class FileWrapper:
+    """The `wsgi.file_wrapper` handed to applications.
+
+    When the wrapped object is a real file, the response is sent with
+    `socket.sendfile` like any other static file.
+    """
+
+    __slots__ = ("filelike", "blksize")
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data: break
+            yield data
+
+    def close(self):
+        if hasattr(self.filelike, "close"):
+            self.filelike.close()
+
+_process_apps = {}
+def _run_in_process(spec, environ):
+    # runs inside a worker process, so the response can only be returned whole
+    app = _process_apps.get(spec)
+    if app is None:
+        app = _process_apps[spec] = load_app(spec)
+
+    environ["wsgi.input"] = io.BytesIO(environ.pop("snakeserver.payload"))
+    environ["wsgi.errors"] = sys.stderr
+    environ["wsgi.file_wrapper"] = FileWrapper
+
+    state = {}
+    body = []
+    def start_response(status, headers, exc_info=None):
+        state["status"], state["headers"] = status, headers
+        return body.append
+
+    result = app(environ, start_response)
+    try:
+        body.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    return state["status"], state["headers"], b"".join(body)
+
+class WSGIApplication:
+    """A route handler which runs a WSGI application on a dedicated executor.
+
+    The application is called on the executor's workers, so a slow application
+    occupies a worker rather than the accepting server. Responses are streamed
+    back to the client with chunked encoding unless the application sets a
+    Content-Length.
+    """
+
+    def __init__(self, spec, config):
+        self.spec = spec
+        self.process = config.get("wsgi_executor", "thread") == "process"
+        workers = config.get("wsgi_workers", 4)
+        self.timeout = config.get("wsgi_timeout", 30)
+        if self.process:
+            self.app = None
+            # forked workers would inherit the sockets open at the time, keeping clients connected
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+        else:
+            self.app = load_app(spec)
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="wsgi")
+
+    def environ(self, req):
+        script_name, path_info = (req.base or "").rstrip("/"), req.path or ""
+        if not path_info.startswith("/"):
+            path_info = "/" + path_info
+
+        query = req.fullpath.partition("?")[2].partition("#")[0]
+        environ = {
+            "REQUEST_METHOD": req.method,
+            "SCRIPT_NAME": script_name,
+            "PATH_INFO": path_info,
+            "QUERY_STRING": query,
+            "SERVER_NAME": req.host,
+            "SERVER_PORT": str(req.port),
+            "SERVER_PROTOCOL": "HTTP/" + req.version,
+            "REMOTE_ADDR": str(req.addr[0]),
+            "REMOTE_PORT": str(req.addr[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.multithread": not self.process,
+            "wsgi.multiprocess": self.process,
+            "wsgi.run_once": False
+        }
+
+        for key, value in req.headers.items():
+            key = key.upper().replace("-", "_")
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                environ["HTTP_" + key] = value
+
+        if self.process:
+            environ["snakeserver.payload"] = req.payload
+        else:
+            environ["wsgi.input"] = io.BytesIO(req.payload)
+            environ["wsgi.errors"] = sys.stderr
+            environ["wsgi.file_wrapper"] = FileWrapper
+
+        return environ
+
+    def _produce(self, environ, out, cancelled):
+        # runs on an executor thread, handing (kind, value) pairs to the connection
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    out.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def start_response(status, headers, exc_info=None):
+            put(("head", (status, headers)))
+            return lambda data: put(("data", data))
+
+        try:
+            result = self.app(environ, start_response)
+            if isinstance(result, FileWrapper):
+                if not put(("file", result)):
+                    result.close()
+                return
+
+            try:
+                for chunk in result:
+                    if chunk and not put(("data", chunk)):
+                        return
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+            put(("end", None))
+
+        except Exception as e:
+            put(("error", e))
+
+    def _messages(self, req):
+        environ = self.environ(req)
+        if self.process:
+            future = self.executor.submit(_run_in_process, self.spec, environ)
+            try:
+                status, headers, body = future.result(self.timeout)
+            except TimeoutError:
+                future.cancel()
+                yield "timeout", None
+                return
+            except Exception as e:
+                yield "error", e
+                return
+
+            yield "head", (status, headers)
+            if body:
+                yield "data", body
+            yield "end", None
+            return
+
+        out = queue.Queue(QUEUE_SIZE)
+        cancelled = threading.Event()
+        self.executor.submit(self._produce, environ, out, cancelled)
+        try:
+            while True:
+                try:
+                    kind, value = out.get(timeout=self.timeout)
+                except queue.Empty:
+                    # the producer stops at its next message; a hung application keeps its worker
+                    cancelled.set()
+                    yield "timeout", None
+                    return
+
+                yield kind, value
+                if kind in ("end", "file", "error"):
+                    return
+        finally:
+            cancelled.set()
+
+    def __call__(self, req, res):
+        head = None
+        for kind, value in self._messages(req):
+            if kind == "head":
+                head = value
+
+            elif kind == "timeout":
+                print("WSGI application timed out", file=sys.stderr)
+                if res.headers_sent:
+                    raise ProtocolError("The WSGI application timed out mid-response!")
+                raise HTTPError(codes.GATEWAY_TIMEOUT)
+
+            elif kind == "error":
+                print(value, file=sys.stderr)
+                if res.headers_sent:
+                    raise ProtocolError("The WSGI application failed mid-response!")
+                raise HTTPError(codes.INTERNAL_SERVER_ERROR)
+
+            elif head is None:
+                print("WSGI application sent a body before start_response", file=sys.stderr)
+                raise HTTPError(codes.INTERNAL_SERVER_ERROR)
+
+            elif kind == "file":
+                try:
+                    self._send_file(req, res, head, value)
+                finally:
+                    value.close()
+
+            else:
+                if not res.headers_sent:
+                    self._write_head(req, res, head)
+
+                if kind == "data":
+                    self._write(req, res, value)
+                else:
+                    self._finish(req, res)
+
+    def _apply_head(self, res, head):
+        status, headers = head
+        for key, value in headers:
+            res.set(key.title(), value)
+
+        res.status(int(status.split(" ", 1)[0]))
+
+    def _write_head(self, req, res, head):
+        self._apply_head(res, head)
+        # HTTP/2 frames bodies itself, so only HTTP/1.1 needs chunked encoding
+        if req.method != "HEAD" and "1.1" <= req.version < "2" and "Content-Length" not in res.headers:
+            res.set("Transfer-Encoding", "chunked")
+
+        res.write_head()
+
+    def _write(self, req, res, data):
+        if req.method == "HEAD":
+            return
+
+        if res.headers.get("Transfer-Encoding") == "chunked":
+            res.send_chunk(data)
+        else:
+            res.write(data)
+
+    def _finish(self, req, res):
+        if req.method != "HEAD" and res.headers.get("Transfer-Encoding") == "chunked":
+            res.send_chunk(b"")
+        elif req.method != "HEAD" and "Content-Length" not in res.headers:
+            # without chunked encoding, the body can only be delimited by closing
+            res.end()
+
+        res.body_sent = True
+
+    def _send_file(self, req, res, head, wrapper):
+        fp = wrapper.filelike
+        try:
+            fp.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fp = None
+
+        if fp is None or req.method == "HEAD":
+            self._write_head(req, res, head)
+            for chunk in wrapper:
+                self._write(req, res, chunk)
+            return self._finish(req, res)
+
+        self._apply_head(res, head)
+        length = res.headers.get("Content-Length")
+        res.send_stream(fp, int(length) if length is not None else None)
+
+    def close(self):
+        self.executor.shutdown(wait=False)